@@ -9,9 +9,10 @@
 
 import hassapi as hass
 import datetime
+import threading
 import numpy as np
 from time import sleep
-from scipy import interpolate
+from concurrent.futures import ThreadPoolExecutor
 
 # state of a white ambiance lamp:
 # state: {'entity_id': 'light.stern_wohnzimmer', 'state': 'on',
@@ -22,7 +23,50 @@ from scipy import interpolate
 # 'brightness': 200, 'hs_color': [50.597, 52.549], 'rgb_color': [255, 233, 121], 'xy_color': [0.431, 0.439],
 # 'effect': 'none', 'friendly_name': 'Zeltlampe', 'supported_features': 61}
 
+# curves for the change of a value between two keyframes. Each curve maps the time
+# passed since the previous keyframe, offset_s, to an eased time in the same range
+# [0, dt_s], with dt_s being the time between the two keyframes:
+interpolation_curves = {
+    # constant speed from keyframe to keyframe:
+    'linear': lambda offset_s, dt_s: offset_s,
+    # ease-in-out, starts and stops smoothly at each keyframe:
+    'cubic': lambda offset_s, dt_s: (offset_s / dt_s) ** 2 * (3.0 - 2.0 * offset_s / dt_s) * dt_s,
+    # holds the value of a keyframe until the next keyframe is reached:
+    'step': lambda offset_s, dt_s: np.where(offset_s >= dt_s, dt_s, 0.0),
+    }
+
+# interpolates keyframes for one or more time instants, NumPy-only replacement for
+# scipy's interp1d. keyframes_values can have one value per keyframe (like brightness)
+# or multiple channels per keyframe (like color_rgb), time_s can be a scalar or an array.
+# The result has the shape of time_s plus the channels of keyframes_values:
+def interpolate_keyframes(time_s, keyframes_time_s, keyframes_values, curve='linear'):
+    keyframes_time_s = np.asarray(keyframes_time_s, dtype=float)
+    keyframes_values = np.asarray(keyframes_values, dtype=float)
+    time_s = np.asarray(time_s, dtype=float)
+
+    # index of the keyframe before each time instant, the last interval is used for
+    # the last keyframe itself:
+    k = np.searchsorted(keyframes_time_s, time_s, side='right') - 1
+    k = np.clip(k, 0, len(keyframes_time_s) - 2)
+
+    # time since the previous keyframe, limited to the interval between both keyframes:
+    dt_s = keyframes_time_s[k + 1] - keyframes_time_s[k]
+    offset_s = np.clip(time_s - keyframes_time_s[k], 0.0, dt_s)
+    offset_s = interpolation_curves[curve](offset_s, dt_s)
+
+    # append an axis for each channel of the values:
+    channels = (1, ) * (keyframes_values.ndim - 1)
+    dt_s = dt_s.reshape(dt_s.shape + channels)
+    offset_s = offset_s.reshape(offset_s.shape + channels)
+
+    # same arithmetic as np.interp to get the same values for linear curves:
+    slope = (keyframes_values[k + 1] - keyframes_values[k]) / dt_s
+    return slope * offset_s + keyframes_values[k]
+
 # definitions of the effects:
+# 'time_s' holds the time instants of the keyframes, 'attributes' the values of each
+# attribute at these keyframes. The optional 'curve' selects how values change
+# between keyframes, one of interpolation_curves, 'linear' if not given.
 effects_definition = dict()
 
 # smooth on and off for a light:
@@ -42,6 +86,15 @@ effects_definition['Sparkle-Up'] = {
         }
     }
 
+# smooth on and off for a light, easing in and out at full and no brightness:
+effects_definition['Breathing'] = {
+    'time_s': [ 0.0, 3.0, 6.0 ],
+    'curve': 'cubic',
+    'attributes': {
+        'brightness': [ 0.0, 1.0, 0.0 ],
+        }
+    }
+
 # changes a light color from red over green to blue:
 effects_definition['RGB-Color-Wheel'] = { 
     'time_s': [ 0.0, 4.0, 8.0 ],
@@ -84,8 +137,193 @@ effects_definition_multiple_entities['Underwater Worlds'] = {
     'delays': (0.0, 3.0)
     }
 
+# procedural effects for many light entities, computed for all lights with one array
+# operation per time step. 'type' selects the pattern, which gives each light a level
+# between 0 and 1 depending on its position (its index if no positions are configured).
+# 'time_s' is the duration of the effect, 'attributes' hold the values at level 0 and
+# level 1. The optional 'curve' selects how values change between both levels.
+effects_definition_procedural = dict()
+
+# a brightness and color wave running along the lights:
+effects_definition_procedural['Wave'] = {
+    'type': 'wave',
+    'time_s': 8.0,
+    # distance between two wave crests in units of the light positions:
+    'wavelength': 8.0,
+    'attributes': {
+        'brightness': [ 0.1, 1.0 ],
+        'color_rgb': [
+            [ 0.0, 0.0, 1.0 ],
+            [ 0.0, 1.0, 1.0 ]
+            ]
+        }
+    }
+
+# a bright spot with a fading tail running along all lights once per 'time_s':
+effects_definition_procedural['Chase'] = {
+    'type': 'chase',
+    'time_s': 10.0,
+    # length of the tail in units of the light positions:
+    'width': 3.0,
+    'curve': 'cubic',
+    'attributes': {
+        'brightness': [ 0.0, 1.0 ],
+        'color_temp': [ 454.0, 250.0 ],
+        }
+    }
+
+# lights twinkle at random times, reproducible by the seed of the random generator:
+effects_definition_procedural['Twinkle'] = {
+    'type': 'twinkle',
+    'time_s': 20.0,
+    'seed': 26,
+    # minimum and maximum number of twinkles of each light within 'time_s':
+    'twinkles': [ 2, 6 ],
+    # higher values give shorter twinkles:
+    'sharpness': 4.0,
+    'attributes': {
+        'brightness': [ 0.05, 1.0 ],
+        'color_temp': [ 454.0, 250.0 ],
+        }
+    }
+
 input_select_effect_mode_states = { 'off': 'Aus', 'once': 'Einmal', 'loop': 'Loop' }
 
+# matrix from linear RGB to CIE XYZ, Wide RGB D65 like Home Assistant's color_RGB_to_xy,
+# so the xy colors are the same as if Home Assistant converted rgb_color itself:
+rgb_to_xyz = np.array([
+    [ 0.664511, 0.154324, 0.162028 ],
+    [ 0.283881, 0.668433, 0.047685 ],
+    [ 0.000088, 0.072310, 0.986039 ]
+    ])
+
+# converts rgb colors (values between 0 and 1, last axis) to CIE xy chromaticities,
+# black becomes (0, 0) like in Home Assistant:
+def rgb_to_xy(color_rgb):
+    color_rgb = np.asarray(color_rgb, dtype=float)
+
+    # remove sRGB gamma:
+    linear_rgb = np.where(color_rgb > 0.04045, ((color_rgb + 0.055) / 1.055) ** 2.4, color_rgb / 12.92)
+    xyz = linear_rgb @ rgb_to_xyz.T
+    total = xyz.sum(axis=-1, keepdims=True)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        color_xy = xyz[..., :2] / total
+    return np.where(total > 0.0, color_xy, 0.0)
+
+# converts rgb colors (values between 0 and 1, last axis) to hue in degrees and
+# saturation in percent like Home Assistant's hs_color, same arithmetic as
+# colorsys.rgb_to_hsv used by Home Assistant:
+def rgb_to_hs(color_rgb):
+    color_rgb = np.asarray(color_rgb, dtype=float)
+    r, g, b = color_rgb[..., 0], color_rgb[..., 1], color_rgb[..., 2]
+    maximum = color_rgb.max(axis=-1)
+    delta = maximum - color_rgb.min(axis=-1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rc = (maximum - r) / delta
+        gc = (maximum - g) / delta
+        bc = (maximum - b) / delta
+        hue = np.where(r == maximum, bc - gc, np.where(g == maximum, 2.0 + rc - bc, 4.0 + gc - rc))
+        hue = (hue / 6.0) % 1.0
+        saturation = delta / maximum
+
+    # gray colors have neither hue nor saturation:
+    hue = np.where(delta > 0.0, hue, 0.0)
+    saturation = np.where(delta > 0.0, saturation, 0.0)
+    return np.stack([ hue * 360.0, saturation * 100.0 ], axis=-1)
+
+# reads what a light supports from its state, like
+# {'state': 'on', 'attributes': {'supported_color_modes': ['color_temp', 'xy'], 'min_mireds': 250, 'max_mireds': 454, ...}}
+def read_light_capabilities(state):
+    if state is not None and 'attributes' in state:
+        attributes = state['attributes']
+    else:
+        attributes = {}
+
+    supported_color_modes = attributes.get('supported_color_modes')
+    if supported_color_modes is None:
+        # unknown capabilities, send rgb colors and color temperatures to the light:
+        supported_color_modes = [ 'rgb', 'color_temp' ]
+
+    # native color space of the light for rgb colors of the effects:
+    if 'xy' in supported_color_modes:
+        color_mode = 'xy'
+    elif 'hs' in supported_color_modes:
+        color_mode = 'hs'
+    elif len({'rgb', 'rgbw', 'rgbww'} & set(supported_color_modes)) > 0:
+        color_mode = 'rgb'
+    else:
+        color_mode = None
+
+    return {
+        'color_mode': color_mode,
+        'brightness': any(mode != 'onoff' for mode in supported_color_modes),
+        'color_temp': 'color_temp' in supported_color_modes,
+        'min_mireds': attributes.get('min_mireds'),
+        'max_mireds': attributes.get('max_mireds'),
+        }
+
+# encodes the states of lights with the same capabilities in their native color space.
+# brightness and color_temp have one value per state, color_rgb three values between 0
+# and 1 (last axis), color_rgb and color_temp can be None. The states can be given for
+# several time instants and lights at once, like (time instants, lights). Returns a flat
+# list, in row-major order, with the service data for light/turn_on for each state:
+def encode_light_states(capabilities, brightness, color_rgb, color_temp):
+    brightness = (np.asarray(brightness).reshape(-1) * 255).astype(int).tolist()
+    if color_rgb is not None:
+        color_rgb = np.asarray(color_rgb).reshape(-1, 3)
+    if color_temp is not None:
+        color_temp = np.asarray(color_temp).reshape(-1)
+
+    # add either a color or color_temp, never both:
+    color_key = None
+    if color_rgb is not None and capabilities['color_mode'] is not None:
+        # the same 8 bit values as sent in rgb_color, converted and rounded to 3 decimals
+        # like Home Assistant does:
+        color_rgb = (np.asarray(color_rgb) * 255).astype(int)
+        if capabilities['color_mode'] == 'xy':
+            color_key = 'xy_color'
+            color_values = [ [ round(x, 3), round(y, 3) ] for x, y in rgb_to_xy(color_rgb / 255).tolist() ]
+        elif capabilities['color_mode'] == 'hs':
+            color_key = 'hs_color'
+            color_values = [ [ round(h, 3), round(s, 3) ] for h, s in rgb_to_hs(color_rgb / 255).tolist() ]
+        else:
+            color_key = 'rgb_color'
+            color_values = color_rgb.tolist()
+    elif color_rgb is None and color_temp is not None and capabilities['color_temp']:
+        # brightness and color_temp are set in one call, setting both does not work for Tradfri lights:
+        # 'I encountered a problem when trying to set both the brightness and the color temperature in a Home Assistant service call (light.turn_on). Apparently, the Tradfri bulbs only respond to one of these values at a time.':
+        # https://www.wouterbulten.nl/blog/tech/ikea-tradfri-temp-and-brightness-with-home-assistant/
+        # but setting the two values with two calls does not look well for our animations.
+        color_key = 'color_temp'
+        # limit to the range of the light, values outside are rejected:
+        color_temp = np.asarray(color_temp).astype(int)
+        if capabilities['min_mireds'] is not None:
+            color_temp = np.maximum(color_temp, capabilities['min_mireds'])
+        if capabilities['max_mireds'] is not None:
+            color_temp = np.minimum(color_temp, capabilities['max_mireds'])
+        color_values = color_temp.tolist()
+
+    service_data = []
+    for k in range(len(brightness)):
+        service_data_for_time_instant = {}
+        if capabilities['brightness']:
+            service_data_for_time_instant['brightness'] = brightness[k]
+        if color_key is not None:
+            service_data_for_time_instant[color_key] = color_values[k]
+        service_data.append(service_data_for_time_instant)
+
+    return service_data
+
+# number of time steps after which an effect repeats, None if the effect does not repeat
+# after a whole number of time steps:
+def get_num_time_steps(max_time_s, time_interval_s, offset_s):
+    num_time_steps = max_time_s / time_interval_s
+    if not np.isclose(num_time_steps, round(num_time_steps)) or not np.isclose(offset_s / time_interval_s, round(offset_s / time_interval_s)):
+        return None
+    return round(num_time_steps)
+
 class EffectForLight:
     def __init__(self, light_entity, initial_effect_type):
         self.light_entity = light_entity
@@ -104,7 +342,10 @@ class EffectForLight:
 
         # read vector with time instants:
         self.time_s = effects_definition[effect_type]['time_s']
-        
+
+        # read curve between keyframes:
+        self.curve = effects_definition[effect_type].get('curve', 'linear')
+
         # read brightness value for each time step:
         self.fp_brightness = effects_definition[effect_type]['attributes']['brightness']
 
@@ -116,54 +357,340 @@ class EffectForLight:
 
         if 'color_rgb' in effects_definition[effect_type]['attributes']:
             # read color_rgb value for each time step:
-            y = effects_definition[effect_type]['attributes']['color_rgb']
-            
-            print(f'self.time_s: {self.time_s}, y: {y}')
-            self.f_color_rgb = interpolate.interp1d(self.time_s, y, axis=0)
+            self.fp_color_rgb = effects_definition[effect_type]['attributes']['color_rgb']
+            print(f'self.time_s: {self.time_s}, y: {self.fp_color_rgb}')
         else:
-            self.f_color_rgb = None
-            
-    def get_state_for_time_instant(self, infinite_time_s):
+            self.fp_color_rgb = None
+
+    def get_states_for_time_instants(self, infinite_time_s):
         # infinite_time_s can grow infinitely, we limit it to the maximum time of the 
         # current effect:
-        time_s = infinite_time_s % self.time_s[-1]
+        time_s = np.asarray(infinite_time_s) % self.time_s[-1]
         
-        # compute new brightness value:
-        new_brightness = int(np.interp(time_s, self.time_s, self.fp_brightness) * 255)
+        # compute new brightness values:
+        new_brightness = interpolate_keyframes(time_s, self.time_s, self.fp_brightness, self.curve)
 
-        # compute new brightness value:
-        if self.fp_color_temp != None:
-            new_color_temp = int(np.interp(time_s, self.time_s, self.fp_color_temp))
+        # compute new color temperature values:
+        if self.fp_color_temp is not None:
+            new_color_temp = interpolate_keyframes(time_s, self.time_s, self.fp_color_temp, self.curve)
         else:
             new_color_temp = None
             
-        # compute new rgb color value if rgb_color is defined for this effect:
-        if self.f_color_rgb == None:
-            new_color_rgb = np.array([None, None, None ])
+        # compute new rgb color values if rgb_color is defined for this effect:
+        if self.fp_color_rgb is not None:
+            new_color_rgb = interpolate_keyframes(time_s, self.time_s, self.fp_color_rgb, self.curve)
         else:
-            #new_color_rgb = int(np.interp(time_s, self.time_s, self.fp_color_rgb) * 255)
-            new_color_rgb = (self.f_color_rgb(time_s) * 255).astype(int)
-            print(f"new_color_rgb: {new_color_rgb}")
+            new_color_rgb = None
         
         return new_brightness, new_color_rgb, new_color_temp
 
+    def compile(self, light_capabilities, time_interval_s, offset_s):
+        self.light_capabilities = light_capabilities
+        self.time_interval_s = time_interval_s
+        self.offset_s = offset_s
+
+        # precompute the service data of all time steps if the effect repeats after a
+        # whole number of time steps, otherwise it is computed at each time step:
+        num_time_steps = get_num_time_steps(self.get_max_time(), time_interval_s, offset_s)
+        if num_time_steps is not None:
+            self.frames = self.encode_time_steps(np.arange(num_time_steps))
+        else:
+            self.frames = None
+
+    def encode_time_steps(self, time_steps):
+        new_brightness, new_color_rgb, new_color_temp = self.get_states_for_time_instants(time_steps * self.time_interval_s + self.offset_s)
+        return encode_light_states(self.light_capabilities, new_brightness, new_color_rgb, new_color_temp)
+
+    def get_service_data_for_time_step(self, time_step):
+        if self.frames is not None:
+            return self.frames[time_step % len(self.frames)]
+        return self.encode_time_steps(np.array([ time_step ]))[0]
+
+class ProceduralEffectForLights:
+    def __init__(self, light_entities, light_positions, initial_effect_type):
+        self.light_entities = light_entities
+        self.light_positions = np.asarray(light_positions, dtype=float)
+
+        # typical distance between two neighboring lights, the gap a chase crosses from
+        # the last light back to the first one:
+        distances = np.diff(np.unique(self.light_positions))
+        if len(distances) > 0:
+            self.light_spacing = float(np.median(distances))
+        else:
+            self.light_spacing = 1.0
+
+        # read initial effects definition:
+        self.read_effect_definition(effects_definition_procedural, initial_effect_type)
+
+    def get_light_entities(self):
+        return self.light_entities
+
+    def get_max_time(self):
+        return self.time_s
+
+    def read_effect_definition(self, effects_definition, effect_type):
+        print(f"read_effect_definition: {len(self.light_entities)} entities, new effect_type '{effect_type}'")
+
+        self.effect_definition = effects_definition[effect_type]
+        self.type = self.effect_definition['type']
+        self.time_s = self.effect_definition['time_s']
+        self.curve = self.effect_definition.get('curve', 'linear')
+
+        attributes = self.effect_definition['attributes']
+        self.fp_brightness = attributes['brightness']
+        self.fp_color_temp = attributes.get('color_temp')
+        self.fp_color_rgb = attributes.get('color_rgb')
+
+        if self.type == 'twinkle':
+            # draw number of twinkles and phase of each light once, the effect then
+            # repeats identically after time_s:
+            rng = np.random.default_rng(self.effect_definition['seed'])
+            min_twinkles, max_twinkles = self.effect_definition['twinkles']
+            self.twinkles = rng.integers(min_twinkles, max_twinkles + 1, size=len(self.light_entities))
+            self.phases = rng.random(len(self.light_entities))
+
+    def get_levels_for_time_instants(self, time_s):
+        # fraction of the effect that has passed, one row per time instant:
+        progress = np.asarray(time_s)[..., np.newaxis] / self.time_s
+
+        if self.type == 'wave':
+            wavelength = self.effect_definition['wavelength']
+            return 0.5 + 0.5 * np.cos(2 * np.pi * (progress - self.light_positions / wavelength))
+        elif self.type == 'chase':
+            # the spot runs from the first to the last light and starts over again:
+            start = self.light_positions.min()
+            span = self.light_positions.max() - start + self.light_spacing
+            spot = start + progress * span
+            # distance of each light behind the spot:
+            distance = (spot - self.light_positions) % span
+            return np.clip(1.0 - distance / self.effect_definition['width'], 0.0, 1.0)
+        elif self.type == 'twinkle':
+            sharpness = self.effect_definition['sharpness']
+            return (0.5 - 0.5 * np.cos(2 * np.pi * (self.twinkles * progress + self.phases))) ** sharpness
+        else:
+            raise ValueError(f"unknown procedural effect type '{self.type}'")
+
+    def get_states_for_time_instants(self, infinite_time_s):
+        # infinite_time_s can grow infinitely, we limit it to the maximum time of the
+        # current effect:
+        time_s = np.asarray(infinite_time_s) % self.time_s
+
+        # levels of all lights at once, one row per time instant:
+        levels = self.get_levels_for_time_instants(time_s)
+
+        # compute new brightness values:
+        new_brightness = interpolate_keyframes(levels, [ 0.0, 1.0 ], self.fp_brightness, self.curve)
+
+        # compute new color temperature values:
+        if self.fp_color_temp is not None:
+            new_color_temp = interpolate_keyframes(levels, [ 0.0, 1.0 ], self.fp_color_temp, self.curve)
+        else:
+            new_color_temp = None
+
+        # compute new rgb color values:
+        if self.fp_color_rgb is not None:
+            new_color_rgb = interpolate_keyframes(levels, [ 0.0, 1.0 ], self.fp_color_rgb, self.curve)
+        else:
+            new_color_rgb = None
+
+        return new_brightness, new_color_rgb, new_color_temp
+
+    def compile(self, light_capabilities, time_interval_s):
+        # capabilities of each light, same order as the light entities:
+        self.light_capabilities = light_capabilities
+        self.time_interval_s = time_interval_s
+
+        # group the lights with the same capabilities, each group is encoded at once:
+        groups = dict()
+        for k, capabilities in enumerate(light_capabilities):
+            groups.setdefault(tuple(sorted(capabilities.items())), []).append(k)
+        self.capability_groups = [ (light_capabilities[indices[0]], np.array(indices)) for indices in groups.values() ]
+
+        # precompute the service data of all time steps if the effect repeats after a
+        # whole number of time steps, otherwise it is computed at each time step:
+        num_time_steps = get_num_time_steps(self.get_max_time(), time_interval_s, 0.0)
+        if num_time_steps is not None:
+            self.frames = self.encode_time_steps(np.arange(num_time_steps))
+        else:
+            self.frames = None
+
+    def encode_time_steps(self, time_steps):
+        new_brightness, new_color_rgb, new_color_temp = self.get_states_for_time_instants(time_steps * self.time_interval_s)
+
+        # one list with the service data of all lights per time step:
+        frames = [ [ None ] * len(self.light_entities) for time_step in time_steps ]
+
+        # encode all time steps of a group of lights with the same capabilities at once:
+        for capabilities, indices in self.capability_groups:
+            service_data = encode_light_states(capabilities, new_brightness[:, indices],
+                None if new_color_rgb is None else new_color_rgb[:, indices],
+                None if new_color_temp is None else new_color_temp[:, indices])
+
+            for k, service_data_for_light in enumerate(service_data):
+                frames[k // len(indices)][indices[k % len(indices)]] = service_data_for_light
+
+        return frames
+
+    def get_service_data_for_time_step(self, time_step):
+        if self.frames is not None:
+            return self.frames[time_step % len(self.frames)]
+        return self.encode_time_steps(np.array([ time_step ]))[0]
+
+# Frame clock and service call dispatch shared by all LightsEffectsStars app instances.
+# Instead of one timer per app, all running effects (sessions) register here, are
+# rendered together at each tick of one timer and their service calls are sent by a
+# fixed number of worker threads.
+class EffectEngine:
+    def __init__(self, time_interval_s, max_workers):
+        # update interval in s:
+        self.time_interval_s = time_interval_s
+        self.max_workers = max_workers
+
+        # app instances with a running effect:
+        self.sessions = []
+        self.lock = threading.Lock()
+
+        # app instance that owns the timer of the frame clock and its handle:
+        self.clock_app = None
+        self.clock_handle = None
+
+        # worker threads, created with the first session, and the jobs of the last dispatched frame:
+        self.executor = None
+        self.pending_jobs = []
+
+    def register(self, app):
+        with self.lock:
+            if app not in self.sessions:
+                self.sessions.append(app)
+            self.update_clock()
+
+    def unregister(self, app):
+        with self.lock:
+            if app in self.sessions:
+                self.sessions.remove(app)
+
+            # no effect running anymore, stop the timer:
+            if len(self.sessions) == 0:
+                self.stop_clock()
+
+    def remove_app(self, app):
+        # the app is stopped, its timer stops as well, restart it on another session:
+        with self.lock:
+            if app in self.sessions:
+                self.sessions.remove(app)
+
+            if self.clock_app is app or len(self.sessions) == 0:
+                self.stop_clock()
+            self.update_clock()
+
+            # no effect running anymore, stop the worker threads so none are left behind
+            # when AppDaemon reloads this module:
+            if len(self.sessions) == 0 and self.executor is not None:
+                self.executor.shutdown(wait=False)
+                self.executor = None
+
+    def update_clock(self):
+        # starts the timer on the first session if it is not running, called with lock held:
+        if self.clock_handle is None and len(self.sessions) > 0:
+            self.clock_app = self.sessions[0]
+            self.clock_handle = self.clock_app.run_every(self.tick, "now", self.time_interval_s)
+
+        if self.executor is None and len(self.sessions) > 0:
+            self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='light-effects')
+
+    def stop_clock(self):
+        # called with lock held:
+        if self.clock_handle is not None:
+            self.clock_app.cancel_timer(self.clock_handle)
+            self.clock_app = None
+            self.clock_handle = None
+
+    def tick(self, kwargs):
+        with self.lock:
+            sessions = list(self.sessions)
+
+            # Home Assistant did not process the last frame in time, delay all sessions by
+            # one tick instead of queueing up more and more service calls:
+            if not all(job.done() for job in self.pending_jobs):
+                if len(sessions) > 0:
+                    sessions[0].log("EffectEngine: last frame still being sent, delaying all effects by one frame")
+                return
+
+        # render the frames of all sessions, sessions can unregister while rendering:
+        service_calls = []
+        for app in sessions:
+            try:
+                for light_entity, service_data in app.render_frame():
+                    service_calls.append((app, light_entity, service_data))
+            except Exception as exception:
+                # only stop the failing session, the others keep running:
+                app.log(f"EffectEngine: ERROR: rendering frame failed, stopping effect: {exception}")
+                self.unregister(app)
+
+        with self.lock:
+            if len(service_calls) == 0 or self.executor is None:
+                return
+
+            # split the service calls evenly to the worker threads:
+            self.pending_jobs = [ self.executor.submit(self.send, service_calls[k::self.max_workers])
+                                  for k in range(min(self.max_workers, len(service_calls))) ]
+
+    def send(self, service_calls):
+        for app, light_entity, service_data in service_calls:
+            try:
+                app.set_light_state(light_entity, service_data)
+            except Exception as exception:
+                app.log(f"EffectEngine: ERROR: setting state of {light_entity} failed: {exception}")
+
+    def wait_for_frame(self):
+        # waits until the service calls of the last frame are sent:
+        for job in self.pending_jobs:
+            job.result()
+
+# update interval in s and number of threads to send service calls:
+effect_engine = EffectEngine(time_interval_s=.5, max_workers=4)
+
 class LightsEffectsStars(hass.Hass):
     def initialize(self):
         self.log("Starting Lights Effects Stars")
 
         # read entities:
         light_entities = self.split_device_list(self.args["light_entities"]) 
+        self.light_entities = light_entities
         self.log(f"light entities: {light_entities}, effect mode input_select: {self.args['effect_mode_select_entity']}, effect type input_select: {self.args['effect_type_select_entity']}")
 
-        # update interval in s:
-        self.time_interval_s = .5
+        # positions of the lights for procedural effects, the index of each light if not configured:
+        self.light_positions = list(range(len(light_entities)))
+        if 'light_positions' in self.args:
+            try:
+                light_positions = [ float(position) for position in self.split_device_list(self.args['light_positions']) ]
+            except ValueError as exception:
+                light_positions = None
+                self.log(f"LightsEffectsStars: ERROR: invalid light positions '{self.args['light_positions']}': {exception}, using the index of each light instead")
+
+            if light_positions is not None:
+                if len(light_positions) == len(light_entities):
+                    self.light_positions = light_positions
+                else:
+                    self.log(f"LightsEffectsStars: ERROR: {len(light_positions)} light positions for {len(light_entities)} light entities, using the index of each light instead")
+
+        # update interval in s of the shared frame clock:
+        self.time_interval_s = effect_engine.time_interval_s
+
+        # render_frame runs on the thread of the effect engine's clock, the callbacks of
+        # this app on their own threads, the lock keeps them from changing the effect at
+        # the same time:
+        self.session_lock = threading.RLock()
+
+        # read color modes and color temperature range of all lights once:
+        self.light_capabilities = {}
+        for light_entity in light_entities:
+            self.light_capabilities[light_entity] = read_light_capabilities(self.get_state(light_entity, attribute='all'))
+            self.log(f"capabilities of {light_entity}: {self.light_capabilities[light_entity]}")
 
         # the current time step as integer:
         self.time_step = 0
 
-        #self.f_color_rgb = None
-        
-        self.loop_handle = None
         # populate states for effect mode input_select:
         modes = ()
         for item in input_select_effect_mode_states:
@@ -182,6 +709,8 @@ class LightsEffectsStars(hass.Hass):
             # list the effects for multiple light entities:
             for effect_type in effects_definition_multiple_entities:
                 types += (effect_type, )
+            for effect_type in effects_definition_procedural:
+                types += (effect_type, )
             
         self.call_service('input_select/set_options', entity_id=self.args['effect_type_select_entity'],
                               options=types)
@@ -207,136 +736,144 @@ class LightsEffectsStars(hass.Hass):
         effect_type = self.get_state(self.args['effect_type_select_entity'])
 
         # setup objects for all entities:
-        self.effects_for_lights = ()
-        if len(light_entities) == 1:
-            # one light entity:
-            self.effects_for_lights += (EffectForLight(light_entities[0], effect_type), )
-            self.offset_s = (0.0, )
-        else:
-            # multiple light entities:
-            for k, light_entity in enumerate(light_entities):
-                self.effects_for_lights += (EffectForLight(light_entity, effects_definition_multiple_entities[effect_type]['effects'][k]), )
+        self.setup_effect(effect_type)
+
+    def setup_effect(self, effect_type):
+        with self.session_lock:
+            self.effects_for_lights = ()
+            self.procedural_effect = None
+            if len(self.light_entities) == 1:
+                # one light entity:
+                self.effects_for_lights += (EffectForLight(self.light_entities[0], effect_type), )
+                self.offset_s = (0.0, )
+            elif effect_type in effects_definition_procedural:
+                # multiple light entities, all computed by one object:
+                self.procedural_effect = ProceduralEffectForLights(self.light_entities, self.light_positions, effect_type)
+                self.procedural_effect.compile([ self.light_capabilities[light_entity] for light_entity in self.light_entities ], self.time_interval_s)
+            else:
+                # multiple light entities:
+                for k, light_entity in enumerate(self.light_entities):
+                    self.effects_for_lights += (EffectForLight(light_entity, effects_definition_multiple_entities[effect_type]['effects'][k]), )
                 
-            self.offset_s = effects_definition_multiple_entities[effect_type]['delays']
-    
+                self.offset_s = effects_definition_multiple_entities[effect_type]['delays']
+
+            # precompute the service data in the color space of each light:
+            for k, effect_for_light in enumerate(self.effects_for_lights):
+                effect_for_light.compile(self.light_capabilities[effect_for_light.get_light_entity()], self.time_interval_s, self.offset_s[k])
+
     def effect_mode_changed(self, entity, attribute, old, new, kwargs):
-        self.log(f"LightsEffectsStars: new effect mode: {new}")
-        if new in ('Aus', 'Einmal', 'Loop'):
-            if new == 'Aus':
-                self.state = 'off'
-                self.time_step = 0
+        with self.session_lock:
+            self.log(f"LightsEffectsStars: new effect mode: {new}")
+            if new in ('Aus', 'Einmal', 'Loop'):
+                if new == 'Aus':
+                    self.state = 'off'
+                    self.time_step = 0
                 
-                if self.loop_handle != None:
-                    self.cancel_timer(self.loop_handle)
+                    effect_engine.unregister(self)
                     
-            elif new == 'Einmal':
-                self.state = 'once'
-                self.log(f"new mode: {new}, run effect once")
-                self.loop_handle = self.run_every(self.loop, "now", self.time_interval_s)
-            elif new == 'Loop':
-                self.state = 'loop'
-                self.log(f"new mode: {new}, activating looping")
-                self.loop_handle = self.run_every(self.loop, "now", self.time_interval_s)
-                            
+                elif new == 'Einmal':
+                    self.state = 'once'
+                    self.log(f"new mode: {new}, run effect once")
+                    effect_engine.register(self)
+                elif new == 'Loop':
+                    self.state = 'loop'
+                    self.log(f"new mode: {new}, activating looping")
+                    effect_engine.register(self)
+
     def effect_type_changed(self, entity, attribute, old, new, kwargs):
         self.log(f"LightsEffectsStars: new effect type: {new}")
 
         # update effects definitions:
-        if len(self.effects_for_lights) == 1:
+        if len(self.light_entities) == 1:
             # one light entity:
             if new not in effects_definition:
-                self.log(f"new state: {new} is not in list of effects for single light entities, de-activating looping")
-                # TODO
-
-            self.effects_for_lights[0].read_effect_definition(effects_definition, new)
+                self.log(f"new state: {new} is not in list of effects for single light entities, keeping current effect")
+                return
         else:
             # multiple light entities:
-            if new not in effects_definition_multiple_entities:
-                self.log(f"new state: {new} is not in list of effects for multiple light entities, de-activating looping")
-                # TODO
-
-            for k, effect_for_light in enumerate(self.effects_for_lights):
-                effect_for_light.read_effect_definition(effects_definition, effects_definition_multiple_entities[new]['effects'][k])
+            if new not in effects_definition_multiple_entities and new not in effects_definition_procedural:
+                self.log(f"new state: {new} is not in list of effects for multiple light entities, keeping current effect")
+                return
 
-            self.offset_s = effects_definition_multiple_entities[new]['delays']
+        self.setup_effect(new)
             
-    def loop(self, a):
-        # current time:
-        time_s = self.time_step * self.time_interval_s
-
-        # for all light entities:
-        max_time = 0.0
-        for k, effect_for_light in enumerate(self.effects_for_lights):
-            # compute maximum time of all effects:
-            if effect_for_light.get_max_time() > max_time:
-                max_time = effect_for_light.get_max_time() 
-                
-            light_entity = effect_for_light.get_light_entity()
-                
-            # get new values for this time:
-            new_brightness, new_color_rgb, new_color_temp = effect_for_light.get_state_for_time_instant(time_s + self.offset_s[k])
-            
-            self.log(f"time_s: {time_s}, new_brightness: {new_brightness}, new_color_rgb: {new_color_rgb}, new_color_temp: {new_color_temp}")
-
-            # crete dict with keyword arguments for brightness, rgb color and color termperature
-            # to be set in self.turn_on below:
-            parameters = {}
-            # was brightness provided by get_state_for_time_instant?
-            if new_brightness != None:
-                # if brightness was provided, add it to keyword arguments:
-                parameters['brightness'] = f'{new_brightness}'
-
-            # if-elif: add either color_rgb or color_temp, never both:
-            # was color_rgb provided by get_state_for_time_instant?
-            if new_color_rgb.all() != None:
-                parameters['rgb_color'] = [f'{new_color_rgb[0]}', f'{new_color_rgb[1]}', f'{new_color_rgb[2]}' ]
-
-                # set brightness and rgb color with one call:
-                self.turn_on(light_entity, **parameters, transition=1.2*self.time_interval_s)
-
-            # if not, was color temperature provided by get_state_for_time_instant?
-            elif new_color_temp != None:
-                # set both at same time:
-                parameters['color_temp'] = f'{new_color_temp}'
-                self.turn_on(light_entity, **parameters, transition=1.2*self.time_interval_s)
-
-                # setting both brightness and color temperature does not work for Tradfri lights:                
-                # 'I encountered a problem when trying to set both the brightness and the color temperature in a Home Assistant service call (light.turn_on). Apparently, the Tradfri bulbs only respond to one of these values at a time.':
-                # https://www.wouterbulten.nl/blog/tech/ikea-tradfri-temp-and-brightness-with-home-assistant/
-
-                # setting the two values with two calls does not look well for our animations:
-                #print(f'setting color_temp to {new_color_temp}')
-                #self.turn_on(light_entity, color_temp=f'{new_color_temp}', transition=0.2*self.time_interval_s)
-                #sleep(0.3*self.time_interval_s)
-                # set brightness at .5 transition time:
-                #print(f'setting brightness to {parameters}')
-                #self.turn_on(light_entity, **parameters, transition=0.7*self.time_interval_s)
-                
+    def terminate(self):
+        # app is stopped or reloaded, hand the frame clock over to another app:
+        effect_engine.remove_app(self)
+
+    # computes the next frame, called by effect_engine at each tick. Returns a list of
+    # light entities and their service data, the engine sends them:
+    def render_frame(self):
+        with self.session_lock:
+            # the effect was switched off after the engine started this tick, it is
+            # registered and unregistered while holding session_lock:
+            if self not in effect_engine.sessions:
+                return []
+
+            # current time:
+            time_s = self.time_step * self.time_interval_s
+            service_calls = []
+
+            if self.procedural_effect is not None:
+                max_time = self.procedural_effect.get_max_time()
+
+                # get service data of all light entities for this time step:
+                service_data_of_lights = self.procedural_effect.get_service_data_for_time_step(self.time_step)
+
+                self.log(f"time_s: {time_s}, new values for {len(self.light_entities)} light entities")
+
+                # lights without any attribute to set, like on/off lights, are skipped:
+                for light_entity, service_data in zip(self.procedural_effect.get_light_entities(), service_data_of_lights):
+                    if len(service_data) > 0:
+                        service_calls.append((light_entity, service_data))
+
             else:
-                # only set brightness:
-                self.turn_on(light_entity, **parameters, transition=1.2*self.time_interval_s)
+                # for all light entities:
+                max_time = 0.0
+                for effect_for_light in self.effects_for_lights:
+                    # compute maximum time of all effects:
+                    if effect_for_light.get_max_time() > max_time:
+                        max_time = effect_for_light.get_max_time() 
                     
-        # increment time step integer:                    
-        self.time_step += 1        
-
-        # is the aninmation over? for multiple animations? is the longest over?:
-        if time_s >= max_time:
-            # yes:
-            if self.state == 'off':
-                # go to state off:
-                # if we're here, the timer might still be running, cancel it again:
-                self.cancel_timer(self.loop_handle)
-                self.time_step = 0
-                self.call_service('input_select/select_option', entity_id=self.args['effect_mode_select_entity'],
-                      option=input_select_effect_mode_states['off'])
-            elif self.state == 'once':
-                # go to state off:
-                self.state == 'off'
-                self.time_step = 0
-                self.call_service('input_select/select_option', entity_id=self.args['effect_mode_select_entity'],
-                      option=input_select_effect_mode_states['off'])
-
-                self.cancel_timer(self.loop_handle)
-            elif self.state == 'loop':
-                # do nothing, let time grow
-                pass
+                    light_entity = effect_for_light.get_light_entity()
+                    
+                    # get service data for this time step:
+                    service_data = effect_for_light.get_service_data_for_time_step(self.time_step)
+                
+                    self.log(f"time_s: {time_s}, {light_entity}: {service_data}")
+
+                    # lights without any attribute to set, like on/off lights, are skipped:
+                    if len(service_data) > 0:
+                        service_calls.append((light_entity, service_data))
+
+            # increment time step integer:                    
+            self.time_step += 1        
+
+            # is the aninmation over? for multiple animations? is the longest over?:
+            if time_s >= max_time:
+                # yes:
+                if self.state == 'off':
+                    # go to state off:
+                    # if we're here, the effect might still be registered, unregister it again:
+                    effect_engine.unregister(self)
+                    self.time_step = 0
+                    self.call_service('input_select/select_option', entity_id=self.args['effect_mode_select_entity'],
+                          option=input_select_effect_mode_states['off'])
+                elif self.state == 'once':
+                    # go to state off:
+                    self.state == 'off'
+                    self.time_step = 0
+                    self.call_service('input_select/select_option', entity_id=self.args['effect_mode_select_entity'],
+                          option=input_select_effect_mode_states['off'])
+
+                    effect_engine.unregister(self)
+                elif self.state == 'loop':
+                    # do nothing, let time grow
+                    pass
+
+            return service_calls
+
+    def set_light_state(self, light_entity, service_data):
+        # service_data holds brightness and color in the native color space of the light,
+        # already limited to its range:
+        self.turn_on(light_entity, **service_data, transition=1.2*self.time_interval_s)
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+# \author fms13
+# \date October 19, 2026
+#
+# \brief Renders effects of appdaemon/light-effects.py offline and benchmarks them
+#
+# Runs the LightsEffectsStars app without AppDaemon and Home Assistant. A stub of
+# hassapi.Hass records all turn_on and call_service calls and simulates run_every
+# timers on a simulated clock, so rendering T seconds of an effect does not take
+# T seconds. Several app instances can run at the same time, sharing the effect engine.
+#
+# Command line parameters:
+#
+# -e, --effect: name of the effect to be rendered
+# -n, --lights: number of light entities per app instance, default 1
+# -s, --sessions: number of app instances running the effect at the same time, default 1
+# -t, --time: simulated time in s, default 10
+# -m, --mode: 'once' or 'loop', default 'loop'
+# -c, --color-modes: supported color modes of the lights, default 'color_temp,xy'
+# --mireds: color temperature range of the lights, default '250,454'
+# -f, --frames: write the service calls of each frame as JSON to this file
+# -v, --verbose: print the output of the app
+#
+# Example calls:
+#
+# render-light-effects.py -e 'Underwater World' -t 13 -f underwater-world.json
+# render-light-effects.py -e Twinkle -n 200 -t 60
+# render-light-effects.py -e Wave -n 20 -c rgb
+# render-light-effects.py -e Chase -n 30 -s 10 -t 60
+#
+# The report shows the CPU time per frame, the number of service calls per second and
+# the values of the first frames.
+
+import os
+import sys
+import io
+import json
+import time
+import types
+import argparse
+import contextlib
+import importlib.util
+
+# path of the app to be rendered:
+light_effects_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'appdaemon', 'light-effects.py')
+
+# entities of the input_select fields used by the app:
+effect_mode_select_entity = 'input_select.light_effect_mode'
+effect_type_select_entity = 'input_select.light_effect_type'
+
+##
+# @brief Simulated Home Assistant and AppDaemon scheduler shared by all StubHass apps
+class SimulatedHomeAssistant:
+    def __init__(self, states):
+        # states of all entities, entity -> {'state': ..., 'attributes': {...}}:
+        self.states = states
+
+        # listen_state callbacks, entity -> list of callbacks:
+        self.state_callbacks = dict()
+
+        # timers, handle -> [callback, next time in s, interval in s]:
+        self.timers = dict()
+        self.next_timer_handle = 0
+
+        # simulated time in s:
+        self.now_s = 0.0
+
+        # recorded service calls, list of (time in s, service, keyword arguments):
+        self.service_calls = []
+
+    ##
+    # @brief runs all timers due within duration_s, returns the CPU time of each callback
+    #
+    # after_callback is called after each timer callback and counted in its CPU time.
+    def run_for(self, duration_s, after_callback=None):
+        end_s = self.now_s + duration_s
+        cpu_times_s = []
+        while len(self.timers) > 0:
+            # next timer to be due:
+            handle = min(self.timers, key=lambda handle: self.timers[handle][1])
+            callback, next_s, interval = self.timers[handle]
+            if next_s >= end_s:
+                break
+
+            self.now_s = next_s
+            self.timers[handle][1] = next_s + interval
+
+            start_s = time.process_time()
+            callback({})
+            if after_callback is not None:
+                after_callback()
+            cpu_times_s.append(time.process_time() - start_s)
+
+        self.now_s = end_s
+        return cpu_times_s
+
+##
+# @brief Stub of hassapi.Hass, records service calls and simulates timers
+class StubHass:
+    def __init__(self, args, home_assistant, verbose=False):
+        self.args = args
+        self.home_assistant = home_assistant
+        self.verbose = verbose
+
+    def log(self, message):
+        if self.verbose:
+            print(f"{self.home_assistant.now_s:8.2f} {message}")
+
+    def split_device_list(self, devices):
+        return [ device.strip() for device in devices.split(',') ]
+
+    def get_state(self, entity, attribute=None):
+        state = self.home_assistant.states.get(entity)
+        if state is None:
+            return None
+        if attribute is None:
+            return state['state']
+        if attribute == 'all':
+            return state
+        return state['attributes'].get(attribute)
+
+    def set_state(self, entity, state):
+        old = self.get_state(entity)
+        self.home_assistant.states.setdefault(entity, {'state': None, 'attributes': {}})['state'] = state
+
+        # call listen_state callbacks like AppDaemon does, only if the state changed:
+        if old != state:
+            for callback in self.home_assistant.state_callbacks.get(entity, []):
+                callback(entity, 'state', old, state, {})
+
+    def listen_state(self, callback, entity):
+        self.home_assistant.state_callbacks.setdefault(entity, []).append(callback)
+        return (entity, callback)
+
+    def call_service(self, service, **kwargs):
+        self.home_assistant.service_calls.append((self.home_assistant.now_s, service, kwargs))
+
+        if service == 'input_select/select_option':
+            self.set_state(kwargs['entity_id'], kwargs['option'])
+
+    def turn_on(self, entity_id, **kwargs):
+        self.home_assistant.service_calls.append((self.home_assistant.now_s, 'light/turn_on', dict(entity_id=entity_id, **kwargs)))
+
+        state = self.home_assistant.states.setdefault(entity_id, {'state': 'on', 'attributes': {}})
+        state['state'] = 'on'
+        state['attributes'].update(kwargs)
+
+    def run_every(self, callback, start, interval):
+        # only start 'now' is needed by the app:
+        handle = self.home_assistant.next_timer_handle
+        self.home_assistant.next_timer_handle += 1
+        self.home_assistant.timers[handle] = [ callback, self.home_assistant.now_s, interval ]
+        return handle
+
+    def cancel_timer(self, handle):
+        self.home_assistant.timers.pop(handle, None)
+
+##
+# @brief loads light-effects.py with StubHass as hassapi.Hass
+def load_light_effects():
+    hassapi = types.ModuleType('hassapi')
+    hassapi.Hass = StubHass
+    sys.modules['hassapi'] = hassapi
+
+    spec = importlib.util.spec_from_file_location('light_effects', light_effects_path)
+    light_effects = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(light_effects)
+    return light_effects
+
+##
+# @brief groups the recorded turn_on calls by their time into frames, sorted by entity
+def get_frames(service_calls):
+    frames = []
+    for time_s, service, kwargs in service_calls:
+        if service != 'light/turn_on':
+            continue
+        if len(frames) == 0 or frames[-1]['time_s'] != time_s:
+            frames.append({'time_s': time_s, 'lights': []})
+        frames[-1]['lights'].append(kwargs)
+
+    # the worker threads send the lights in any order, sort them so frames can be compared:
+    for frame in frames:
+        frame['lights'].sort(key=lambda light: light['entity_id'])
+    return frames
+
+def main():
+    parser = argparse.ArgumentParser(description='Renders an effect of light-effects.py without Home Assistant.')
+    parser.add_argument('-e', '--effect', required=True, help='name of the effect')
+    parser.add_argument('-n', '--lights', type=int, default=1, help='number of light entities')
+    parser.add_argument('-s', '--sessions', type=int, default=1, help='number of app instances running the effect')
+    parser.add_argument('-t', '--time', type=float, default=10.0, help='simulated time in s')
+    parser.add_argument('-m', '--mode', choices=('once', 'loop'), default='loop', help='effect mode')
+    parser.add_argument('-c', '--color-modes', default='color_temp,xy', help='supported color modes of the lights')
+    parser.add_argument('--mireds', default='250,454', help='min and max color temperature of the lights in mireds')
+    parser.add_argument('-f', '--frames', help='file to write the frames to as JSON')
+    parser.add_argument('-v', '--verbose', action='store_true', help='print the output of the app')
+    args = parser.parse_args()
+
+    light_effects = load_light_effects()
+    modes = light_effects.input_select_effect_mode_states
+
+    states = {}
+    min_mireds, max_mireds = [ int(mireds) for mireds in args.mireds.split(',') ]
+    home_assistant = SimulatedHomeAssistant(states)
+
+    # the app prints debug output, only show it if requested:
+    output = sys.stdout if args.verbose else io.StringIO()
+    with contextlib.redirect_stdout(output):
+        # one app instance with its own lights and input_select fields per session:
+        apps = []
+        for session in range(args.sessions):
+            light_entities = [ f'light.effect_{session:02d}_{k:03d}' for k in range(args.lights) ]
+            for light_entity in light_entities:
+                states[light_entity] = {'state': 'on', 'attributes': {
+                    'supported_color_modes': args.color_modes.split(','),
+                    'min_mireds': min_mireds,
+                    'max_mireds': max_mireds,
+                    }}
+
+            app_args = {
+                'light_entities': ','.join(light_entities),
+                'effect_mode_select_entity': f'{effect_mode_select_entity}_{session:02d}',
+                'effect_type_select_entity': f'{effect_type_select_entity}_{session:02d}',
+                }
+            states[app_args['effect_mode_select_entity']] = {'state': modes['off'], 'attributes': {}}
+            states[app_args['effect_type_select_entity']] = {'state': args.effect, 'attributes': {}}
+
+            app = light_effects.LightsEffectsStars(app_args, home_assistant, verbose=args.verbose)
+            app.initialize()
+            apps.append(app)
+
+        # only count the calls of the effects themselves:
+        home_assistant.service_calls = []
+
+        # starting the effects like a user selecting the mode:
+        for app in apps:
+            app.set_state(app.args['effect_mode_select_entity'], modes[args.mode])
+
+        # wait for the service calls of each frame so they are recorded at the right time:
+        cpu_times_s = home_assistant.run_for(args.time, light_effects.effect_engine.wait_for_frame)
+
+    frames = get_frames(home_assistant.service_calls)
+
+    print(f"effect: '{args.effect}', {args.sessions} sessions with {args.lights} light entities, {args.time} s, mode '{args.mode}', color modes '{args.color_modes}'")
+    if len(cpu_times_s) > 0:
+        cpu_times_ms = [ 1000.0 * cpu_time_s for cpu_time_s in cpu_times_s ]
+        print(f"frames: {len(cpu_times_ms)}, CPU time per frame: mean {sum(cpu_times_ms) / len(cpu_times_ms):.3f} ms, max {max(cpu_times_ms):.3f} ms")
+    else:
+        print("frames: 0")
+    print(f"service calls: {len(home_assistant.service_calls)}, {len(home_assistant.service_calls) / args.time:.1f} per s")
+
+    for frame in frames[:5]:
+        print(f"time_s: {frame['time_s']:.2f}, {frame['lights'][0]}")
+    if len(frames) > 5:
+        print(f"... {len(frames) - 5} more frames")
+
+    if args.frames is not None:
+        with open(args.frames, 'w') as frames_file:
+            json.dump(frames, frames_file, indent=1)
+
+if __name__ == '__main__':
+    main()